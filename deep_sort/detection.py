@@ -16,6 +16,7 @@ class Detection(dict):
         Detector confidence score.
     feature : array_like
         A feature vector that describes the object contained in this image.
+        Pass a contiguous float32 ndarray to avoid a conversion copy.
 
     Attributes
     ----------
@@ -25,16 +26,25 @@ class Detection(dict):
         Detector confidence score.
     class_name : ndarray
         Detector class.
-    feature : ndarray | NoneType
-        A feature vector that describes the object contained in this image.
+    feature : ndarray
+        A contiguous float32 feature vector that describes the object
+        contained in this image.
+    tlbr : ndarray
+        Bounding box in format `(min x, min y, max x, max y)`, computed on
+        first access.
+    xyah : ndarray
+        Bounding box in format `(center x, center y, aspect ratio, height)`,
+        computed on first access.
 
     """
 
     def __init__(self, tlwh, confidence, class_name, feature):
-        self.tlwh = np.asarray(tlwh, dtype=np.float)
+        self.tlwh = np.asarray(tlwh, dtype=np.float64)
         self.confidence = float(confidence)
         self.class_name = class_name
-        self.feature = np.asarray(feature, dtype=np.float32)
+        self.feature = np.ascontiguousarray(feature, dtype=np.float32)
+        self._tlbr = None
+        self._xyah = None
 
         dict.__init__(self, tlwh=self.tlwh.tolist(), confidence=self.confidence, class_name=self.class_name,
                       feature=self.feature.tolist())
@@ -44,6 +54,18 @@ class Detection(dict):
     def get_class(self):
         return self.class_name
 
+    @property
+    def tlbr(self):
+        if self._tlbr is None:
+            self._tlbr = self.to_tlbr()
+        return self._tlbr
+
+    @property
+    def xyah(self):
+        if self._xyah is None:
+            self._xyah = self.to_xyah()
+        return self._xyah
+
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
         `(top left, bottom right)`.
@@ -151,6 +151,37 @@ class KalmanFilter(object):
             self._update_mat, covariance, self._update_mat.T))
         return mean, covariance + innovation_cov
 
+    def multi_project(self, mean, covariance):
+        """Project multiple state distributions to measurement space
+        (vectorized version of `project`).
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices of the given state estimates.
+
+        """
+        std = np.ones((len(mean), 4))
+        std[:, 0] = std[:, 1] = std[:, 3] = \
+            self._std_weight_position * mean[:, 3]
+        std[:, 2] = 1e-1
+        innovation_cov = np.zeros((len(mean), 4, 4))
+        diagonal = np.arange(4)
+        innovation_cov[:, diagonal, diagonal] = np.square(std)
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(
+            np.matmul(self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
     def update(self, mean, covariance, measurement):
         """Run Kalman filter correction step.
 
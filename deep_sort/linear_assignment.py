@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 import numpy as np
 from scipy.optimize import linear_sum_assignment as linear_assignment
+from . import _fast
 from . import kalman_filter
 
 
@@ -55,17 +56,16 @@ def min_cost_matching(
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_assignment(cost_matrix)
-    indices = np.asarray(indices)
-    indices = np.transpose(indices)
+    row_indices, col_indices = linear_assignment(cost_matrix)
+    matched_rows, matched_cols = set(row_indices), set(col_indices)
     matches, unmatched_tracks, unmatched_detections = [], [], []
     for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
+        if col not in matched_cols:
             unmatched_detections.append(detection_idx)
     for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
+        if row not in matched_rows:
             unmatched_tracks.append(track_idx)
-    for row, col in indices:
+    for row, col in zip(row_indices, col_indices):
         track_idx = track_indices[row]
         detection_idx = detection_indices[col]
         if cost_matrix[row, col] > max_distance:
@@ -122,12 +122,31 @@ def matching_cascade(
 
     unmatched_detections = detection_indices
     matches = []
+
+    # Evaluate the distance metric once for all tracks that take part in the
+    # cascade. Each level then only selects its rows and the remaining
+    # detection columns from this matrix.
+    cascade_tracks = [
+        k for k in track_indices
+        if 1 <= tracks[k].time_since_update <= cascade_depth]
+    if len(cascade_tracks) == 0 or len(detection_indices) == 0:
+        return [], list(track_indices), detection_indices
+    full_cost_matrix = distance_metric(
+        tracks, detections, cascade_tracks, detection_indices)
+    track_rows = dict((k, i) for i, k in enumerate(cascade_tracks))
+    detection_cols = dict((k, j) for j, k in enumerate(detection_indices))
+
+    def cached_metric(tracks, dets, track_indices_l, detection_indices_l):
+        rows = [track_rows[k] for k in track_indices_l]
+        cols = [detection_cols[k] for k in detection_indices_l]
+        return full_cost_matrix[np.ix_(rows, cols)]
+
     for level in range(cascade_depth):
         if len(unmatched_detections) == 0:  # No detections left
             break
 
         track_indices_l = [
-            k for k in track_indices
+            k for k in cascade_tracks
             if tracks[k].time_since_update == 1 + level
         ]
         if len(track_indices_l) == 0:  # Nothing to match at this level
@@ -135,7 +154,7 @@ def matching_cascade(
 
         matches_l, _, unmatched_detections = \
             min_cost_matching(
-                distance_metric, max_distance, tracks, detections,
+                cached_metric, max_distance, tracks, detections,
                 track_indices_l, unmatched_detections)
         matches += matches_l
     unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
@@ -181,11 +200,18 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return cost_matrix
     measurements = np.asarray(
-        [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
+        [detections[i].xyah for i in detection_indices], dtype=np.float64)
+    means, covariances = [], []
+    for track_idx in track_indices:
         track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
-    return cost_matrix
+        mean, covariance = kf.project(track.mean, track.covariance)
+        means.append(mean[:gating_dim])
+        covariances.append(covariance[:gating_dim, :gating_dim])
+    cholesky_factors = np.linalg.cholesky(
+        np.asarray(covariances, dtype=np.float64))
+    return _fast.gate_cost_matrix_kernel(
+        cost_matrix, np.asarray(means, dtype=np.float64), cholesky_factors,
+        measurements[:, :gating_dim], gating_threshold, gated_cost)
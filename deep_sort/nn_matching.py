@@ -1,4 +1,6 @@
 # vim: expandtab:ts=4:sw=4
+import itertools
+
 import numpy as np
 
 
@@ -54,46 +56,24 @@ def _cosine_distance(a, b, data_is_normalized=False):
     return 1. - np.dot(a, b.T)
 
 
-def _nn_euclidean_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (Euclidean).
-
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest Euclidean distance to a sample in `x`.
-
-    """
-    distances = _pdist(x, y)
-    return np.maximum(0.0, distances.min(axis=0))
-
-
-def _nn_cosine_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (cosine).
+def _normalize(a):
+    """Scale rows in `a` to unit length.
 
     Parameters
     ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
+    a : array_like
+        An NxM matrix of N samples of dimensionality M.
 
     Returns
     -------
     ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest cosine distance to a sample in `x`.
+        Returns the NxM matrix of L2-normalized samples.
 
     """
-    distances = _cosine_distance(x, y)
-    return distances.min(axis=0)
+    a = np.asarray(a)
+    if len(a) == 0:
+        return a
+    return a / np.linalg.norm(a, axis=1, keepdims=True)
 
 
 class NearestNeighborDistanceMetric(object):
@@ -114,25 +94,87 @@ class NearestNeighborDistanceMetric(object):
 
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    samples : Dict[int -> ndarray]
+        A dictionary that maps from target identities to the samples that have
+        been observed so far, one per row and oldest first. Samples are stored
+        as float32 and, for the cosine metric, normalized to unit length. This
+        is assembled on access from the internal sample bank.
 
     """
 
     def __init__(self, metric, matching_threshold, budget=None):
-
-
         if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
+            self._metric = _pdist
+            self._normalize = False
         elif metric == "cosine":
-            self._metric = _nn_cosine_distance
+            self._metric = _cosine_distance
+            self._normalize = True
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+
+        # All samples are stored in the first `_num_samples` rows of one
+        # float32 bank, in no particular order. Row i belongs to target
+        # _row_targets[i] and _target_rows maps each target to its rows,
+        # oldest first.
+        self._bank = None
+        self._row_targets = None
+        self._num_samples = 0
+        self._target_rows = {}
+
+    @property
+    def samples(self):
+        return dict((target, self._bank[rows])
+                    for target, rows in self._target_rows.items())
+
+    def _grow_bank(self, ndim):
+        capacity = 0 if self._bank is None else len(self._bank)
+        new_capacity = max(2 * capacity, 64)
+        bank = np.empty((new_capacity, ndim), dtype=np.float32)
+        row_targets = np.empty((new_capacity, ), dtype=np.int64)
+        if self._bank is not None:
+            bank[:capacity] = self._bank
+            row_targets[:capacity] = self._row_targets
+        self._bank, self._row_targets = bank, row_targets
+
+    def _append_sample(self, target, feature):
+        rows = self._target_rows.setdefault(target, [])
+        if self.budget and len(rows) >= self.budget:
+            # Overwrite the oldest sample of this target.
+            row = rows.pop(0)
+        else:
+            row = self._num_samples
+            if self._bank is None or row == len(self._bank):
+                self._grow_bank(len(feature))
+            self._row_targets[row] = target
+            self._num_samples += 1
+        self._bank[row] = feature
+        rows.append(row)
+
+    def _remove_targets(self, targets):
+        holes = []
+        for target in targets:
+            holes.extend(self._target_rows.pop(target))
+        if len(holes) == 0:
+            return
+        holes = np.asarray(holes, dtype=np.int64)
+        end = self._num_samples - len(holes)
+
+        # Move the rows at or above `end` that are still in use into the
+        # holes below it, so that the occupied rows stay at the front.
+        is_hole = np.zeros((len(holes), ), dtype=np.bool_)
+        is_hole[holes[holes >= end] - end] = True
+        sources = end + np.flatnonzero(~is_hole)
+        destinations = holes[holes < end]
+        self._bank[destinations] = self._bank[sources]
+        self._row_targets[destinations] = self._row_targets[sources]
+        for source, destination in zip(
+                sources.tolist(), destinations.tolist()):
+            rows = self._target_rows[self._row_targets[destination]]
+            rows[rows.index(source)] = destination
+        self._num_samples = end
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -147,11 +189,18 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
+        features = np.asarray(features, dtype=np.float32)
+        if self._normalize:
+            features = _normalize(features)
+        active_targets = set(active_targets)
+        # Only the rows of targets that left the scene or received new
+        # samples are touched; all other samples stay in place.
+        self._remove_targets(
+            [k for k in self._target_rows if k not in active_targets])
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+            if target not in active_targets:
+                continue
+            self._append_sample(target, feature)
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -171,7 +220,26 @@ class NearestNeighborDistanceMetric(object):
             `targets[i]` and `features[j]`.
 
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
+        features = np.asarray(features, dtype=np.float32)
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+        # Gather the bank rows of each requested target into one block of
+        # `order`; block i starts at starts[i].
+        target_rows = [self._target_rows[target] for target in targets]
+        counts = np.fromiter(
+            (len(rows) for rows in target_rows), dtype=np.int64,
+            count=len(target_rows))
+        order = np.fromiter(
+            itertools.chain.from_iterable(target_rows), dtype=np.int64,
+            count=counts.sum())
+        starts = np.cumsum(counts) - counts
+        bank = self._bank[:self._num_samples]
+        if self._normalize:
+            # Samples are normalized in partial_fit, so the query features
+            # only need to be normalized once here.
+            features = _normalize(features)
+            distances = self._metric(bank, features, True)
+        else:
+            distances = self._metric(bank, features)
+
+        return np.minimum.reduceat(distances[order], starts, axis=0)
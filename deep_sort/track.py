@@ -1,4 +1,5 @@
 # vim: expandtab:ts=4:sw=4
+import numpy as np
 
 
 class TrackState:
@@ -41,6 +42,9 @@ class Track:
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
     detection : Detection
+    feature_budget : Optional[int]
+        If not None, the `features` cache holds at most this many features and
+        drops the oldest one when full. Otherwise it grows as needed.
 
     Attributes
     ----------
@@ -58,14 +62,16 @@ class Track:
         Total number of frames since last measurement update.
     state : TrackState
         The current track state.
-    features : List[ndarray]
-        A cache of features. On each measurement update, the associated feature
-        vector is added to this list.
+    features : ndarray
+        A cache of features, one per row. On each measurement update, the
+        associated feature vector is added to this cache. This is a view
+        into a ring buffer that is overwritten after `reset_features`.
     last_detection : Detection
     """
 
     def __init__(self, mean, covariance, track_id, n_init, max_age,
-                 feature=None, class_name=None, detection=None):
+                 feature=None, class_name=None, detection=None,
+                 feature_budget=None):
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
@@ -74,12 +80,16 @@ class Track:
         self.time_since_update = 0
 
         self.state = TrackState.Tentative
-        self.features = []
-        if feature is not None:
-            self.features.append(feature)
-
         self._n_init = n_init
         self._max_age = max_age
+
+        self._feature_budget = feature_budget
+        self._feature_ring = None
+        self._feature_head = 0
+        self._num_features = 0
+        if feature is not None:
+            self._append_feature(feature)
+
         self.class_name = class_name
         self.last_detection = detection
 
@@ -115,6 +125,66 @@ class Track:
     def get_class(self):
         return self.class_name
 
+    @property
+    def features(self):
+        return self.features_view()
+
+    def features_view(self):
+        """Get the cached features in insertion order.
+
+        Returns
+        -------
+        ndarray
+            A matrix with one feature per row. This is a view into the ring
+            buffer unless the cached features wrap around its end.
+
+        """
+        if self._feature_ring is None:
+            return np.empty((0, 0), dtype=np.float32)
+        capacity = len(self._feature_ring)
+        end = self._feature_head + self._num_features
+        if end <= capacity:
+            return self._feature_ring[self._feature_head:end]
+        return np.concatenate((
+            self._feature_ring[self._feature_head:],
+            self._feature_ring[:end - capacity]), axis=0)
+
+    def reset_features(self):
+        """Empty the feature cache. The memory is kept for reuse."""
+        self._feature_head = 0
+        self._num_features = 0
+
+    def _append_feature(self, feature):
+        feature = np.asarray(feature, dtype=np.float32)
+        if self._feature_ring is None:
+            # Tentative tracks collect up to n_init features before they are
+            # confirmed, after which the cache is flushed to the metric every
+            # frame; start small and grow only if this ever fills up.
+            capacity = self._n_init
+            if self._feature_budget is not None:
+                capacity = min(capacity, self._feature_budget)
+            capacity = max(capacity, 1)
+            self._feature_ring = np.empty(
+                (capacity, len(feature)), dtype=np.float32)
+        capacity = len(self._feature_ring)
+        if self._num_features == capacity:
+            if (self._feature_budget is not None and
+                    capacity >= self._feature_budget):
+                # Overwrite the oldest feature.
+                self._feature_ring[self._feature_head] = feature
+                self._feature_head = (self._feature_head + 1) % capacity
+                return
+            new_capacity = 2 * capacity
+            if self._feature_budget is not None:
+                new_capacity = min(new_capacity, self._feature_budget)
+            ring = np.empty((new_capacity, len(feature)), dtype=np.float32)
+            ring[:capacity] = self.features_view()
+            self._feature_ring, self._feature_head = ring, 0
+            capacity = new_capacity
+        index = (self._feature_head + self._num_features) % capacity
+        self._feature_ring[index] = feature
+        self._num_features += 1
+
     def predict(self, kf):
         """Propagate the state distribution to the current time step using a
         Kalman filter prediction step.
@@ -142,8 +212,8 @@ class Track:
 
         """
         self.mean, self.covariance = kf.update(
-            self.mean, self.covariance, detection.to_xyah())
-        self.features.append(detection.feature)
+            self.mean, self.covariance, detection.xyah)
+        self._append_feature(detection.feature)
         self.hits += 1
         self.time_since_update = 0
         if self.state == TrackState.Tentative and self.hits >= self._n_init:
@@ -2,17 +2,46 @@
 from __future__ import absolute_import
 
 import math
+from collections import OrderedDict
+
 import numpy as np
-from scipy import spatial
 
+from . import _fast
 from . import iou_matching
 from . import kalman_filter
 from . import linear_assignment
 from .track import Track
 
 
+def angular_distance_matrix(a, b):
+    """Compute pair-wise angular distance between rows of `a` and `b`.
+
+    Parameters
+    ----------
+    a : array_like
+        An NxM matrix of N samples of dimensionality M.
+    b : array_like
+        An LxM matrix of L samples of dimensionality M.
+
+    Returns
+    -------
+    ndarray
+        Returns a matrix of size len(a), len(b) such that element (i, j)
+        contains the angle between `a[i]` and `b[j]`, scaled to [0, 1].
+
+    """
+    a = np.asarray(a) / np.linalg.norm(a, axis=1, keepdims=True)
+    b = np.asarray(b) / np.linalg.norm(b, axis=1, keepdims=True)
+    # Use the dot product directly; going through 1 - cosine distance loses
+    # precision for nearly (anti-)parallel rows.
+    similarities = np.clip(np.dot(a, b.T), -1., 1.)
+    return np.arccos(similarities) / math.pi
+
+
 def calculate_cosine_distance(a, b):
-    cosine_distance = float(spatial.distance.cosine(a, b))
+    a, b = np.asarray(a), np.asarray(b)
+    cosine_distance = 1. - float(
+        np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
     return cosine_distance
 
 
@@ -23,6 +52,8 @@ def calculate_cosine_similarity(a, b):
 
 def calculate_angular_distance(a, b):
     cosine_similarity = calculate_cosine_similarity(a, b)
+    # Round-off can push the similarity slightly outside [-1, 1].
+    cosine_similarity = max(-1., min(1., cosine_similarity))
     angular_distance = math.acos(cosine_similarity) / math.pi
     return angular_distance
 
@@ -62,6 +93,9 @@ class Tracker:
         Number of frames that a track remains in initialization phase.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
+    tracks_by_id : OrderedDict[int -> Track]
+        The active tracks at the current time step, keyed by track id in
+        order of creation.
     tracks : List[Track]
         The list of active tracks at the current time step.
 
@@ -74,29 +108,58 @@ class Tracker:
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        # Matched tracks report a feature to on_track_feature_add every
+        # `_feature_period` hits.
+        self._feature_period = max(1, self.n_init * 3)
 
         self.kf = kalman_filter.KalmanFilter()
-        self.tracks = []
+        self.tracks_by_id = OrderedDict()
+        self._confirmed_ids = set()
         self._next_id = 1
+
+        # Per-frame track state in structure-of-arrays layout, see
+        # _refresh_track_arrays().
+        self._means = np.empty((0, 8))
+        self._covs = np.empty((0, 8, 8))
+        self._projected_means = np.empty((0, 4))
+        self._cholesky_factors = np.empty((0, 4, 4))
+        # Grow-only scratch buffers reused from frame to frame.
+        self._buf = {}
         self.on_track_add = on_track_add
         self.on_track_feature_add = on_track_feature_add
 
+    @property
+    def tracks(self):
+        """List[Track]: The active tracks in order of creation."""
+        return list(self.tracks_by_id.values())
+
     def predict(self):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
         """
-        for track in self.tracks:
+        for track in self.tracks_by_id.values():
             track.predict(self.kf)
 
     def cosine_similarity(self, a, b):
-        """
+        """Compute the cosine similarity between two feature vectors.
+
+        Parameters
+        ----------
+        a : array_like
+            A feature vector.
+        b : array_like
+            A feature vector of the same dimensionality as `a`.
+
+        Returns
+        -------
+        float
+            The cosine of the angle between `a` and `b`.
 
-        :param b:
-        :return:
         """
-        return sum([i * j for i, j in zip(a, b)]) / (
-                math.sqrt(sum([i * i for i in a])) * math.sqrt(sum([i * i for i in b])))
+        a = np.asarray(a, dtype=np.float32)
+        b = np.asarray(b, dtype=np.float32)
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
 
     def update(self, detections, video="", frame_id=0, frame=None):
         """Perform measurement update and track management.
@@ -113,102 +176,183 @@ class Tracker:
             current frame image
 
         """
+        # Matching works on indices into this snapshot of the track set.
+        tracks = self.tracks
+
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(tracks, detections)
 
         # Update track set.
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(self.kf, detections[detection_idx])
+            track = tracks[track_idx]
+            track.update(self.kf, detections[detection_idx])
+            if track.is_confirmed():
+                self._confirmed_ids.add(track.track_id)
             if self.on_track_feature_add is not None:
                 #  confirmed feature
-                if self.tracks[track_idx].hits % (self.n_init * 3) == 0:
-                    bbox = detections[detection_idx].to_tlbr()
-                    crop_img = frame[int(bbox[1]):int(bbox[3]), int(bbox[0]):int(bbox[2])]
-                    self.on_track_feature_add(video, frame_id, crop_img.copy(),
-                                              bbox,
-                                              self.tracks[track_idx].track_id,
-                                              self.tracks[track_idx].features[-1],
-                                              detections[detection_idx].confidence)
+                if track.hits % self._feature_period == 0:
+                    self._emit_feature(
+                        video, frame_id, frame, track,
+                        detections[detection_idx])
 
         for track_idx in unmatched_tracks:
-            self.tracks[track_idx].mark_missed()
+            track = tracks[track_idx]
+            track.mark_missed()
+            if track.is_deleted():
+                del self.tracks_by_id[track.track_id]
+                self._confirmed_ids.discard(track.track_id)
         for detection_idx in unmatched_detections:
             # for track in self.tracks:
             #     print("newid %d track_id=%d feature distance %f " % (
             #         self._next_id, track.track_id, calculate_cosine_similarity(track.last_detection.feature,
             #                                                                  detections[detection_idx].feature)))
 
-            self._initiate_track(detections[detection_idx])
+            track = self._initiate_track(detections[detection_idx])
             if self.on_track_add is not None:
-                self.on_track_add(video, frame_id, frame, self.tracks[- 1].track_id, self.tracks[- 1].class_name)
+                self.on_track_add(video, frame_id, frame, track.track_id, track.class_name)
 
             if self.on_track_feature_add is not None:  # first seen feature
-                bbox = detections[detection_idx].to_tlbr()
-                crop_img = frame[int(bbox[1]):int(bbox[3]), int(bbox[0]):int(bbox[2])]
-                self.on_track_feature_add(video, frame_id, crop_img.copy(),
-                                          bbox,
-                                          self.tracks[- 1].track_id,
-                                          detections[detection_idx].feature,
-                                          detections[detection_idx].confidence)
-
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+                self._emit_feature(
+                    video, frame_id, frame, track,
+                    detections[detection_idx])
 
         # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
-        features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-            track.features = []
-        self.metric.partial_fit(
-            np.asarray(features), np.asarray(targets), active_targets)
-
-    def _match(self, detections):
+        active_targets = list(self._confirmed_ids)
+        feature_arrays, counts = [], []
+        for track_id in active_targets:
+            track = self.tracks_by_id[track_id]
+            features = track.features_view()
+            counts.append(len(features))
+            if len(features) > 0:
+                feature_arrays.append(features)
+            # The view stays valid until the next feature is appended.
+            track.reset_features()
+        if len(feature_arrays) > 0:
+            features = np.concatenate(feature_arrays, axis=0)
+        else:
+            features = np.empty((0, 0), dtype=np.float32)
+        targets = np.repeat(np.fromiter(
+            active_targets, dtype=np.int64, count=len(active_targets)), counts)
+        self.metric.partial_fit(features, targets, active_targets)
+
+    def _buf_get(self, name, shape, dtype):
+        """Return an uninitialized array of the given shape and dtype that
+        is backed by a scratch buffer. The buffer is only reallocated when
+        it needs to grow, so the contents are overwritten by the next call
+        with the same `name`.
+        """
+        buf = self._buf.get(name)
+        if (buf is None or buf.shape[0] < shape[0] or
+                buf.shape[1:] != tuple(shape[1:]) or buf.dtype != dtype):
+            buf = np.empty(shape, dtype=dtype)
+            self._buf[name] = buf
+        return buf[:shape[0]]
+
+    def _stack_rows(self, name, rows, row_shape, dtype):
+        """Stack `rows` into the scratch buffer `name`."""
+        out = self._buf_get(name, (len(rows), ) + tuple(row_shape), dtype)
+        if len(rows) > 0:
+            np.stack(rows, axis=0, out=out)
+        return out
+
+    def _refresh_track_arrays(self, tracks):
+        """Stack the state distributions of `tracks` into contiguous arrays
+        and precompute what Mahalanobis gating needs for each of them.
+        """
+        self._means = self._stack_rows(
+            "means", [t.mean for t in tracks], (8, ), np.float64)
+        self._covs = self._stack_rows(
+            "covs", [t.covariance for t in tracks], (8, 8), np.float64)
+        if len(tracks) == 0:
+            self._projected_means = np.empty((0, 4))
+            self._cholesky_factors = np.empty((0, 4, 4))
+            return
+        self._projected_means, projected_covs = self.kf.multi_project(
+            self._means, self._covs)
+        self._cholesky_factors = np.linalg.cholesky(projected_covs)
+
+    def _match(self, tracks, detections):
+        # Nothing to associate on empty frames or before the first track.
+        if len(tracks) == 0:
+            return [], [], list(range(len(detections)))
+        if len(detections) == 0:
+            return [], list(range(len(tracks))), []
+
+        # Gather features, measurements, and track state once per frame; the
+        # matching cascade evaluates gated_metric on subsets of these several
+        # times.
+        feature_shape = detections[0].feature.shape
+        detection_features = self._stack_rows(
+            "features", [d.feature for d in detections], feature_shape,
+            np.float32)
+        measurements = self._stack_rows(
+            "measurements", [d.xyah for d in detections], (4, ),
+            np.float64)
+        track_ids = np.fromiter(
+            (t.track_id for t in tracks), dtype=np.int64, count=len(tracks))
+        self._refresh_track_arrays(tracks)
+        gating_threshold = kalman_filter.chi2inv95[4]
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(
-                self.kf, cost_matrix, tracks, dets, track_indices,
-                detection_indices)
-            return cost_matrix
+            cost_matrix = self.metric.distance(
+                detection_features[detection_indices],
+                track_ids[track_indices])
+            return _fast.gate_cost_matrix_kernel(
+                cost_matrix, self._projected_means[track_indices],
+                self._cholesky_factors[track_indices],
+                measurements[detection_indices], gating_threshold,
+                linear_assignment.INFTY_COST)
 
         # Split track set into confirmed and unconfirmed tracks.
         confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
+            i for i, t in enumerate(tracks) if t.is_confirmed()]
         unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+            i for i, t in enumerate(tracks) if not t.is_confirmed()]
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
                 gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                tracks, detections, confirmed_tracks)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
         iou_track_candidates = unconfirmed_tracks + [
             k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
+            tracks[k].time_since_update == 1]
         unmatched_tracks_a = [
             k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
+            tracks[k].time_since_update != 1]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
+                iou_matching.iou_cost, self.max_iou_distance, tracks,
                 detections, iou_track_candidates, unmatched_detections)
 
         matches = matches_a + matches_b
-        unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
+        # Tracks in unmatched_tracks_b are drawn from iou_track_candidates,
+        # which is disjoint from the remaining unmatched_tracks_a.
+        unmatched_tracks = unmatched_tracks_a + unmatched_tracks_b
         return matches, unmatched_tracks, unmatched_detections
 
+    def _emit_feature(self, video, frame_id, frame, track, detection):
+        """Crop the detection from the frame and pass a copy of it to
+        `on_track_feature_add`.
+        """
+        bbox = detection.tlbr
+        x1, y1, x2, y2 = bbox.astype(np.int32)
+        crop_img = frame[y1:y2, x1:x2].copy()
+        # detection.tlbr is cached on the detection, hand out a copy.
+        self.on_track_feature_add(video, frame_id, crop_img, bbox.copy(),
+                                  track.track_id, detection.feature,
+                                  detection.confidence)
+
     def _initiate_track(self, detection):
-        mean, covariance = self.kf.initiate(detection.to_xyah())
+        mean, covariance = self.kf.initiate(detection.xyah)
         class_name = detection.get_class()
-        self.tracks.append(Track(
+        track = Track(
             mean, covariance, self._next_id, self.n_init, self.max_age,
-            detection.feature, class_name, detection))
+            detection.feature, class_name, detection,
+            getattr(self.metric, "budget", None))
+        self.tracks_by_id[track.track_id] = track
         self._next_id += 1
+        return track
@@ -114,12 +114,17 @@ def create_detections(detection_mat, frame_idx, min_height=0):
         Returns detection responses at given frame index.
 
     """
-    frame_indices = detection_mat[:, 0].astype(np.int)
+    frame_indices = detection_mat[:, 0].astype(np.int64)
     mask = frame_indices == frame_idx
 
+    # Convert features once per frame so each Detection gets a contiguous
+    # float32 row without another copy.
+    rows = detection_mat[mask]
+    features = np.ascontiguousarray(rows[:, 10:], dtype=np.float32)
+
     detection_list = []
-    for row in detection_mat[mask]:
-        bbox, confidence, feature = row[2:6], row[6], row[10:]
+    for row, feature in zip(rows, features):
+        bbox, confidence = row[2:6], row[6]
         if bbox[3] < min_height:
             continue
         detection_list.append(Detection(bbox, confidence, "", feature))